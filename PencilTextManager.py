@@ -11,13 +11,15 @@ Subcomandos:
 
 Requisitos:
   pip install googletrans==4.0.0-rc1
+  pip install lxml   (opcional, acelera extract/replace)
 """
 
-import argparse, csv, gzip, sys, tarfile, tempfile, zipfile, time
-from io import BytesIO
+import argparse, asyncio, csv, gzip, inspect, json, os, sys, tarfile, tempfile, threading, zipfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from io import BufferedReader
 from pathlib import Path
-from typing import Dict, List
-import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Tuple
 import re
 from html import unescape
 
@@ -27,10 +29,45 @@ try:
 except ImportError:
     Translator = None
 
+# Usa lxml si está disponible (parseo y escritura más rápidos); si no, ElementTree estándar.
+try:
+    from lxml import etree as ET
+    HAVE_LXML = True
+    # Sin resolver entidades ni acceder a la red (evita XXE); huge_tree admite
+    # nodos de texto grandes como las imágenes base64, igual que ElementTree
+    XML_OPTS = {"resolve_entities": False, "no_network": True, "huge_tree": True}
+except ImportError:
+    import xml.etree.ElementTree as ET
+    HAVE_LXML = False
+    XML_OPTS = {}
+
 # Constantes para el espacio de nombres de Pencil y los formatos soportados
 PENCIL_NS = "http://www.evolus.vn/Namespace/Pencil"
 ET.register_namespace("p", PENCIL_NS)
+# Prefijo {ns} para búsquedas compatibles con lxml y ElementTree
+P = "{%s}" % PENCIL_NS
+SVG = "{http://www.w3.org/2000/svg}"
+# Propiedades de Pencil que contienen textos de usuario
+PROP_NAMES = frozenset({"text", "label", "contentText", "name", "note"})
+# Datos por hilo (parser lxml reutilizable entre páginas, traductor de googletrans)
+_local = threading.local()
+# Expresión regular para etiquetas HTML, compilada una sola vez
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
 FMT_ZIP = "zip"; FMT_TGZ = "tgz"
+# Tamaño de búfer para leer el .epgz (evita muchas lecturas pequeñas)
+IO_BUFSIZE = 1024 * 1024
+# Nivel de compresión ZIP fijo para que el resultado no dependa de la versión de Python
+ZIP_LEVEL = 6
+# Extensiones de archivos ya comprimidos (se guardan en el ZIP sin comprimir)
+PRECOMPRESSED = frozenset({".png", ".jpg", ".jpeg", ".gif", ".webp", ".zip", ".gz"})
+# Número de textos por lote (cada lote es una llamada a `translate` con una lista;
+# googletrans 4.0.0-rc1 sigue haciendo internamente una petición HTTP por texto)
+BATCH_SIZE = 100
+# Número máximo de lotes traducidos a la vez
+PARALLEL_BATCHES = 8
+# Idiomas de origen/destino y caché persistente de traducciones (junto al CSV)
+SRC_LANG = "es"; DEST_LANG = "en"
+CACHE_NAME = ".translation_cache.json"
 
 def _detect_format(path: Path) -> str:
     """
@@ -49,9 +86,19 @@ def _safe_extract_tar(tar: tarfile.TarFile, dest: Path) -> None:
     Solo permite extraer archivos dentro del directorio destino.
     """
     base = dest.resolve()
-    for member in tar.getmembers():
-        target = base / member.name
-        if not target.resolve().is_relative_to(base):
+    base_str = str(base)
+    prefix = base_str + os.sep
+    members = tar.getmembers()
+    # Sin enlaces basta con comprobar la ruta como texto (sin llamadas al sistema).
+    # Si hay enlaces simbólicos o duros, se resuelve cada ruta en disco como antes.
+    has_links = any(m.issym() or m.islnk() for m in members)
+    for member in members:
+        if has_links:
+            inside = (base / member.name).resolve().is_relative_to(base)
+        else:
+            target = os.path.normpath(os.path.join(base_str, member.name))
+            inside = target == base_str or target.startswith(prefix)
+        if not inside:
             raise RuntimeError(f"Path traversal detectado: {member.name}")
         tar.extract(member, dest)
 
@@ -66,80 +113,115 @@ def _unpack(path: Path, workdir: Path) -> str:
             zf.extractall(workdir)
     else:
         with gzip.open(path, "rb") as gz:
-            with tarfile.open(fileobj=gz, mode="r:") as tar:
+            with tarfile.open(fileobj=BufferedReader(gz, IO_BUFSIZE), mode="r:") as tar:
                 _safe_extract_tar(tar, workdir)
     return fmt
 
+def _walk_files(workdir: Path) -> Iterator[os.DirEntry]:
+    """
+    Recorre el directorio con os.scandir y devuelve las entradas de archivo.
+    Evita crear un Path y hacer un stat por cada entrada, como hace rglob.
+    """
+    stack = [str(workdir)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    yield entry
+
 def _repack(workdir: Path, output: Path, fmt: str) -> None:
     """
     Vuelve a empaquetar el directorio temporal en .epgz (zip o tgz).
     Esto permite crear un nuevo archivo Pencil con los textos modificados.
     """
+    cut = len(str(workdir)) + 1  # Longitud del prefijo "<workdir>/" en cada ruta
     if fmt == FMT_ZIP:
-        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as zf:
-            for p in workdir.rglob("*"):
-                if p.is_file(): zf.write(p, p.relative_to(workdir))
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED, compresslevel=ZIP_LEVEL) as zf:
+            for entry in _walk_files(workdir):
+                # Imágenes y archivos ya comprimidos se guardan sin volver a comprimir
+                ext = os.path.splitext(entry.name)[1].lower()
+                ctype = zipfile.ZIP_STORED if ext in PRECOMPRESSED else zipfile.ZIP_DEFLATED
+                zf.write(entry.path, entry.path[cut:], compress_type=ctype, compresslevel=ZIP_LEVEL)
     else:
-        buf = BytesIO()
-        with tarfile.open(fileobj=buf, mode="w") as tar:
-            for p in workdir.rglob("*"):
-                if p.is_file(): tar.add(p, arcname=p.relative_to(workdir))
-        buf.seek(0)
-        with gzip.open(output, "wb") as gz: gz.write(buf.read())
+        # El tar se escribe directamente sobre el gzip, sin copia intermedia en memoria
+        with gzip.open(output, "wb") as gz:
+            with tarfile.open(fileobj=gz, mode="w") as tar:
+                for entry in _walk_files(workdir):
+                    tar.add(entry.path, arcname=entry.path[cut:])
 
-def _iter_pages(workdir: Path):
+def _iter_pages(workdir: Path) -> Iterator[Path]:
     """
     Devuelve un generador con todos los archivos XML de páginas de Pencil.
     """
-    return workdir.rglob("page_*.xml")
+    for entry in _walk_files(workdir):
+        name = entry.name
+        if name.startswith("page_") and name.endswith(".xml"):
+            yield Path(entry.path)
 
 def _strip_html(text):
     """
     Elimina etiquetas HTML simples de un texto (por ejemplo, <span>).
     Útil para limpiar textos extraídos de propiedades Pencil.
     """
-    return re.sub(r'<[^>]+>', '', unescape(text or '')).strip()
+    return _HTML_TAG_RE.sub('', unescape(text or '')).strip()
 
-def extract(epgz: Path, csv_out: Path) -> None:
+def _parse(xml_file: Path):
     """
-    Extrae textos visibles de <p:property> relevantes, <tspan>, <text> y nodos con p:name.
-    Solo se extraen textos que suelen ser visibles/editables por el usuario.
-    El resultado se guarda en un CSV con columnas: page, text
+    Parsea una página reutilizando un parser por hilo cuando se usa lxml.
+    El parser de ElementTree (expat) no se puede reutilizar tras cerrarlo,
+    así que en ese caso se usa `ET.parse` normal.
+    """
+    if not HAVE_LXML:
+        return ET.parse(str(xml_file))
+    parser = getattr(_local, "parser", None)
+    if parser is None:
+        parser = _local.parser = ET.XMLParser(**XML_OPTS)
+    return ET.parse(str(xml_file), parser)
+
+def _extract_one(xml_file: Path) -> List[str]:
+    """
+    Extrae los textos visibles de una sola página, sin repetir.
+    Se ejecuta en paralelo (un hilo por página), por eso devuelve su propia lista.
+    """
+    texts: List[str] = []
+    seen = set()
+
+    def emit(t):
+        # Los textos vacíos o solo con espacios se descartan antes de nada
+        if t and (txt := t.strip()) and txt not in seen:
+            seen.add(txt)
+            texts.append(txt)
+
+    tree = _parse(xml_file)
+    # 1. <p:property> con textos de usuario
+    for prop in tree.iter(f"{P}property"):
+        if prop.get("name", "") in PROP_NAMES:
+            emit(prop.text)
+    # 2. Nodos con atributo p:name (textos visibles)
+    for elem in tree.iterfind(f".//*[@{P}name]"):
+        emit(''.join(elem.itertext()))
+    # 3. <text> SVG: sus <tspan> y el texto directo (textos en gráficos)
+    svg_tspan = f"{SVG}tspan"
+    for text_elem in tree.iter(f"{SVG}text"):
+        for tspan in text_elem.iterfind(svg_tspan):
+            emit(tspan.text)
+        emit(text_elem.text)
+    return texts
+
+def _extract_from_dir(wd: Path, csv_out: Path) -> None:
+    """
+    Extrae los textos de las páginas de un prototipo ya descomprimido en `wd`
+    y los guarda en un CSV con columnas: page, text
     """
     rows: List[Dict[str, str]] = []
-    ns = {"p": PENCIL_NS}
-    last_text = None  # Evita duplicados consecutivos
-    with tempfile.TemporaryDirectory() as tmp:
-        wd = Path(tmp)
-        _unpack(epgz, wd)
-        for xml_file in _iter_pages(wd):
-            tree = ET.parse(xml_file)
-            root = tree.getroot()
-            # 1. Extraer de <p:property> (textos de usuario)
-            for prop in tree.findall(f".//p:property", ns):
-                name = prop.get("name", "")
-                if name in ("text", "label", "contentText", "name", "note"):
-                    txt = (prop.text or "").strip()
-                    if txt and txt != last_text:
-                        rows.append({"page": xml_file.name, "text": txt})
-                        last_text = txt
-            # 2. Extraer de nodos con atributo p:name (textos visibles)
-            for elem in tree.findall(".//*[@p:name]", ns):
-                txt = ''.join(elem.itertext()).strip()
-                if txt and txt != last_text:
-                    rows.append({"page": xml_file.name, "text": txt})
-                    last_text = txt
-            # 3. Extraer de <text> y <tspan> SVG (textos en gráficos)
-            for text_elem in root.findall(".//{http://www.w3.org/2000/svg}text"):
-                for tspan in text_elem.findall("{http://www.w3.org/2000/svg}tspan"):
-                    txt = (tspan.text or "").strip()
-                    if txt and txt != last_text:
-                        rows.append({"page": xml_file.name, "text": txt})
-                        last_text = txt
-                # Si hay texto directo en <text> (sin tspan)
-                if text_elem.text and text_elem.text.strip() and text_elem.text.strip() != last_text:
-                    rows.append({"page": xml_file.name, "text": text_elem.text.strip()})
-                    last_text = text_elem.text.strip()
+    pages = list(_iter_pages(wd))
+    # Procesa las páginas en paralelo; map conserva el orden de las páginas.
+    # _extract_one ya elimina los textos repetidos dentro de cada página.
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        for xml_file, texts in zip(pages, pool.map(_extract_one, pages)):
+            rows.extend({"page": xml_file.name, "text": txt} for txt in texts)
     # Guarda los textos extraídos en CSV
     with csv_out.open("w", newline="", encoding="utf-8") as fh:
         writer = csv.DictWriter(fh, fieldnames=["page", "text"])
@@ -147,10 +229,66 @@ def extract(epgz: Path, csv_out: Path) -> None:
         writer.writerows(rows)
     print(f"[OK] {len(rows)} cadenas exportadas → {csv_out}")
 
-def replace(epgz: Path, csv_in: Path, output: Path) -> None:
+def extract(epgz: Path, csv_out: Path) -> None:
     """
-    Reemplaza los textos extraídos por sus traducciones usando el CSV traducido.
-    Solo reemplaza si el texto y la página coinciden exactamente.
+    Extrae textos visibles de <p:property> relevantes, <tspan>, <text> y nodos con p:name.
+    Solo se extraen textos que suelen ser visibles/editables por el usuario,
+    y cada texto una sola vez por página. El resultado se guarda en un CSV con columnas: page, text
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        wd = Path(tmp)
+        _unpack(epgz, wd)
+        _extract_from_dir(wd, csv_out)
+
+def _text_nodes(tree) -> Iterator:
+    """
+    Devuelve, sin repetir, solo los nodos de los que `extract` saca textos:
+    <p:property> de usuario, nodos con p:name (con todo su subárbol, porque
+    `extract` usa su itertext, p. ej. <foreignObject p:name=...><div><span>)
+    y <text>/<tspan> SVG. Así `replace` no recorre los nodos puramente estructurales.
+    """
+    props = (e for e in tree.iterfind(f".//{P}property") if e.get("name", "") in PROP_NAMES)
+    return iter(dict.fromkeys(chain(
+        props,
+        chain.from_iterable(e.iter() for e in tree.iterfind(f".//*[@{P}name]")),
+        tree.iter(f"{SVG}text"),
+        tree.iter(f"{SVG}tspan"),
+    )))
+
+def _rewrite_one(xml_file: Path, repls: Dict[Tuple[str, str], str]) -> int:
+    """
+    Aplica las traducciones a una sola página y la guarda si hubo cambios.
+    Devuelve el número de reemplazos. Cada hilo reescribe solo su propio archivo.
+    """
+    page_name = xml_file.name
+    get = repls.get
+    tree = _parse(xml_file)
+    changes = 0
+    for elem in _text_nodes(tree):
+        # Reemplazo en el texto principal del nodo (no en comentarios ni
+        # instrucciones de proceso de lxml, cuyo texto `extract` no exporta)
+        t = elem.text if isinstance(elem.tag, str) else None
+        if t and not t.isspace():
+            new = get((page_name, t.strip()))
+            if new is not None:
+                elem.text = new
+                changes += 1
+        # Reemplazo en el texto "tail" (después del nodo)
+        t = elem.tail
+        if t and not t.isspace():
+            new = get((page_name, t.strip()))
+            if new is not None:
+                elem.tail = new
+                changes += 1
+    # Si hubo cambios, guarda el XML modificado
+    if changes:
+        tree.write(str(xml_file), encoding="utf-8", xml_declaration=True)
+    return changes
+
+def _load_repls(csv_in: Path) -> Dict[Tuple[str, str], str]:
+    """
+    Lee el CSV traducido y devuelve el diccionario (página, texto) → traducción.
+    Termina el programa si el CSV no existe o no tiene filas válidas.
     """
     if not csv_in.exists():
         sys.exit("[ERR] CSV no encontrado")
@@ -158,81 +296,158 @@ def replace(epgz: Path, csv_in: Path, output: Path) -> None:
         reader = csv.DictReader(fh, skipinitialspace=True)
         if not reader.fieldnames:
             sys.exit("[ERR] CSV sin cabeceras válidas")
-        # Lee todas las filas del CSV traducido
-        rows = [{k: (v or "").strip() for k, v in row.items()} for row in reader]
-    # Crea un diccionario para buscar traducciones rápidamente
-    repls = {(r["page"], r["text"]): r["new_text"] for r in rows if r.get("page") and r.get("text") and r.get("new_text")}
+        # Crea en una sola pasada un diccionario para buscar traducciones rápidamente
+        repls: Dict[Tuple[str, str], str] = {}
+        for row in reader:
+            page = (row.get("page") or "").strip()
+            orig = (row.get("text") or "").strip()
+            new = (row.get("new_text") or "").strip()
+            if page and orig and new:
+                repls[(page, orig)] = new
     if not repls:
         sys.exit("[ERR] CSV sin filas válidas")
-    ns = {"p": PENCIL_NS}
+    return repls
+
+def _replace_in_dir(wd: Path, repls: Dict[Tuple[str, str], str], output: Path, fmt: str) -> None:
+    """
+    Aplica las traducciones a un prototipo ya descomprimido en `wd`
+    y, si hubo cambios, lo reempaqueta en `output` con el formato `fmt`.
+    """
+    # Páginas con al menos una traducción: el resto no se parsea
+    pages_with_hits = {page for page, _ in repls}
+    all_pages = list(_iter_pages(wd))
+    pages = [f for f in all_pages if f.name in pages_with_hits]
+    print(f"[INFO] {len(pages)}/{len(all_pages)} páginas con traducciones, el resto no se modifica")
+    # Procesa las páginas en paralelo y suma los reemplazos de cada una
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        changes = sum(pool.map(lambda f: _rewrite_one(f, repls), pages))
+    # Si hubo cambios en algún archivo, vuelve a empaquetar el .epgz
+    if changes:
+        _repack(wd, output, fmt)
+        print(f"[OK] {changes} reemplazos → {output}")
+    else:
+        print("[WARN] Sin cambios realizados.")
+
+def replace(epgz: Path, csv_in: Path, output: Path) -> None:
+    """
+    Reemplaza los textos extraídos por sus traducciones usando el CSV traducido.
+    Solo reemplaza si el texto y la página coinciden exactamente, y solo en los
+    nodos de los que `extract` obtiene textos.
+    """
+    repls = _load_repls(csv_in)
     with tempfile.TemporaryDirectory() as tmp:
         wd = Path(tmp)
         fmt = _unpack(epgz, wd)
-        changes = 0
-        for xml_file in _iter_pages(wd):
-            tree = ET.parse(xml_file)
-            mod = False
-            for elem in tree.iter():
-                # Reemplazo en el texto principal del nodo
-                if elem.text:
-                    orig = elem.text.strip()
-                    key = (xml_file.name, orig)
-                    if key in repls:
-                        elem.text = repls[key]
-                        mod = True
-                        changes += 1
-                # Reemplazo en el texto "tail" (después del nodo)
-                if elem.tail:
-                    orig_tail = elem.tail.strip()
-                    key_tail = (xml_file.name, orig_tail)
-                    if key_tail in repls:
-                        elem.tail = repls[key_tail]
-                        mod = True
-                        changes += 1
-            # Si hubo cambios, guarda el XML modificado
-            if mod:
-                tree.write(xml_file, encoding="utf-8", xml_declaration=True)
-        # Si hubo cambios en algún archivo, vuelve a empaquetar el .epgz
-        if changes:
-            _repack(wd, output, fmt)
-            print(f"[OK] {changes} reemplazos → {output}")
-        else:
-            print("[WARN] Sin cambios realizados.")
+        _replace_in_dir(wd, repls, output, fmt)
+
+def _load_cache(path: Path) -> Dict[str, str]:
+    """
+    Carga la caché de traducciones desde disco. Las claves son "src|dest|texto".
+    Si no existe o está corrupta, se empieza con una caché vacía.
+    """
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as ex:
+        print(f"[WARN] Caché de traducciones ignorada ({ex})")
+        return {}
+
+def _save_cache(path: Path, cache: Dict[str, str]) -> None:
+    """
+    Guarda la caché de traducciones en disco para reutilizarla en próximas ejecuciones.
+    """
+    path.write_text(json.dumps(cache, ensure_ascii=False), encoding="utf-8")
+
+def _translate_sync(text):
+    """
+    Traduce con un `Translator` propio del hilo actual (googletrans 4.0.0-rc1 es
+    bloqueante y su estado de token y cliente HTTP no es seguro entre hilos).
+    """
+    tr = getattr(_local, "translator", None)
+    if tr is None:
+        tr = _local.translator = Translator()
+    return tr.translate(text, src=SRC_LANG, dest=DEST_LANG)
+
+async def _translate(tr, text):
+    """
+    Traduce `text`. Si `tr` es un traductor asíncrono (googletrans posterior a
+    4.0.0-rc1) se espera directamente; si es None, la llamada bloqueante se
+    ejecuta en un hilo aparte con su propio traductor.
+    """
+    if tr is not None:
+        return await tr.translate(text, src=SRC_LANG, dest=DEST_LANG)
+    return await asyncio.to_thread(_translate_sync, text)
+
+async def _translate_batches(texts: List[str]) -> List[Dict[str, str]]:
+    """
+    Traduce los textos en lotes de BATCH_SIZE (una llamada a `translate` por lote),
+    con hasta PARALLEL_BATCHES lotes en vuelo a la vez. Si un lote falla, solo ese
+    lote se reintenta texto a texto.
+    Devuelve, para cada lote, un diccionario texto → traducción.
+    """
+    # Solo se comparte un único traductor si su API es asíncrona
+    tr = Translator() if inspect.iscoroutinefunction(Translator.translate) else None
+    sem = asyncio.Semaphore(PARALLEL_BATCHES)
+
+    async def one(start: int) -> Dict[str, str]:
+        batch = texts[start:start + BATCH_SIZE]
+        label = f"  → {start + 1}-{start + len(batch)}/{len(texts)}..."
+        async with sem:
+            try:
+                results = await _translate(tr, batch)
+                new = {txt: r.text or "" for txt, r in zip(batch, results)}
+                print(f"{label} OK", flush=True)
+            except Exception as ex:
+                # Si falla el lote, se traduce texto a texto solo ese lote
+                print(f"{label} ERROR ({ex}), reintentando uno a uno", flush=True)
+                new = {}
+                for txt in batch:
+                    try:
+                        new[txt] = (await _translate(tr, txt)).text or ""
+                    except Exception as ex_txt:
+                        print(f"    ERROR {txt[:30]}... ({ex_txt})", flush=True)
+            await asyncio.sleep(0.01)  # Espera entre lotes para evitar bloqueos por exceso de peticiones
+            return new
+
+    return await asyncio.gather(*(one(start) for start in range(0, len(texts), BATCH_SIZE)))
 
 def translate_csv(csv_in: Path, csv_out: Path) -> None:
     """
     Traduce el CSV de textos usando Google Translate.
-    Traduce solo los textos únicos y guarda el resultado en un nuevo CSV.
+    Traduce solo los textos únicos que no estén ya en la caché (CACHE_NAME junto al CSV),
+    en lotes de BATCH_SIZE enviados de forma concurrente, y guarda el resultado en un nuevo CSV.
     """
-    if Translator is None:
-        sys.exit("[ERR] 'googletrans' no está instalado")
-    tr = Translator()
-    rows: List[Dict[str, str]] = []
-    # Lee el CSV de entrada
+    # Primera pasada: solo se guardan los textos únicos, no las filas
     with csv_in.open("r", encoding="utf-8", newline="") as fh:
-        reader = list(csv.DictReader(fh))
-    unique_texts = {row["text"] for row in reader}
-    translations = {}
-    print(f"[INFO] Traduciendo {len(unique_texts)} textos únicos...")
-    # Traduce cada texto único
-    for idx, txt in enumerate(unique_texts, start=1):
-        print(f"  → {idx}/{len(unique_texts)}: {txt[:30]}...", end="", flush=True)
-        try:
-            new = tr.translate(txt, src="es", dest="en").text or ""
-            print(" OK")
-        except Exception as ex:
-            print(f" ERROR ({ex})")
-            new = ""
-        translations[txt] = new
-        time.sleep(0.01)  # Espera para evitar bloqueos por exceso de peticiones
-    # Genera el nuevo CSV con las traducciones
-    for row in reader:
-        txt = row.get("text", "")
-        nt = translations.get(txt, "")
-        rows.append({"page": row.get("page", ""), "text": txt, "new_text": nt})
-    with csv_out.open("w", newline="", encoding="utf-8") as fh:
+        unique_texts = {row.get("text") or "" for row in csv.DictReader(fh)}
+    unique_texts.discard("")
+    # Solo se envían a Google los textos que no están ya en la caché
+    cache_path = csv_in.parent / CACHE_NAME
+    cache = _load_cache(cache_path)
+    prefix = f"{SRC_LANG}|{DEST_LANG}|"
+    to_translate = [txt for txt in unique_texts if prefix + txt not in cache]
+    print(f"[INFO] {len(unique_texts)} textos únicos, {len(unique_texts) - len(to_translate)} en caché")
+    if to_translate:
+        if Translator is None:
+            sys.exit("[ERR] 'googletrans' no está instalado")
+        print(f"[INFO] Traduciendo {len(to_translate)} textos...")
+        for new in asyncio.run(_translate_batches(to_translate)):
+            # Las traducciones vacías o fallidas no se guardan para reintentarlas la próxima vez
+            cache.update({prefix + txt: nt for txt, nt in new.items() if nt})
+        _save_cache(cache_path, cache)
+    translations = {txt: cache.get(prefix + txt, "") for txt in unique_texts}
+    # Segunda pasada: genera el nuevo CSV fila a fila, sin cargarlo entero en memoria.
+    # Se escribe en un temporal junto a `csv_out`, así la salida puede ser el mismo CSV.
+    tmp_out = csv_out.with_name(csv_out.name + ".tmp")
+    with csv_in.open("r", encoding="utf-8", newline="") as fh_in, \
+         tmp_out.open("w", newline="", encoding="utf-8") as fh:
+        rows = ({"page": row.get("page", ""), "text": row.get("text", ""),
+                 "new_text": translations.get(row.get("text") or "", "")}
+                for row in csv.DictReader(fh_in))
         writer = csv.DictWriter(fh, fieldnames=["page", "text", "new_text"])
         writer.writeheader(); writer.writerows(rows)
+    os.replace(tmp_out, csv_out)
 
 def main() -> None:
     """
@@ -263,12 +478,16 @@ def main() -> None:
         out_epgz = script_dir / (epgz.stem + "_EN.epgz")
         print(f"[INFO] Procesando archivo: {epgz.name}")
 
-        print("[INFO] Extrayendo textos...")
-        extract(epgz, csv)
-        print("[INFO] Traduciendo textos...")
-        translate_csv(csv, csv_trans)
-        print("[INFO] Reemplazando textos y generando nuevo .epgz...")
-        replace(epgz, csv_trans, out_epgz)
+        # El .epgz se descomprime una sola vez para extraer y reemplazar
+        with tempfile.TemporaryDirectory() as tmp:
+            wd = Path(tmp)
+            fmt = _unpack(epgz, wd)
+            print("[INFO] Extrayendo textos...")
+            _extract_from_dir(wd, csv)
+            print("[INFO] Traduciendo textos...")
+            translate_csv(csv, csv_trans)
+            print("[INFO] Reemplazando textos y generando nuevo .epgz...")
+            _replace_in_dir(wd, _load_repls(csv_trans), out_epgz, fmt)
         print(f"[OK] Proceso completo. Archivo generado: {out_epgz.name}")
         input("\nPresiona Enter para cerrar...")
         return